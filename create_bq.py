@@ -1,18 +1,23 @@
 from google.cloud import bigquery
 
+# Shared BigQuery client, created on first use.
+_CLIENT = None
+
+def _get_client():
+    # Client construction discovers credentials and opens a connection pool, so do it once.
+    global _CLIENT
+    if _CLIENT is None:
+        _CLIENT = bigquery.Client()
+    return _CLIENT
+
 def create_bigquery_table(table_id ,schema):
     # Construct a BigQuery client object.
-    client = bigquery.Client()
+    client = _get_client()
 
     # TODO(developer): Set table_id to the ID of the table to create.
     # table_id = "your-project.your_dataset.your_table_name"
 
-    table_schema = []
-    for field in schema:
-        field_name = field['name']
-        field_type = field['type']
-        field_mode = field['mode']
-        table_schema.append(bigquery.SchemaField(field_name, field_type, mode=field_mode))
+    table_schema = [bigquery.SchemaField(field['name'], field['type'], mode=field['mode']) for field in schema]
 
     table = bigquery.Table(table_id, schema=table_schema)
     table.time_partitioning = bigquery.TimePartitioning(
@@ -1,13 +1,32 @@
 import apache_beam as beam
-from apache_beam.options.pipeline_options import PipelineOptions
+from apache_beam.options.pipeline_options import PipelineOptions, StandardOptions
 from apache_beam.io import WriteToBigQuery
 from apache_beam.io import filesystems
+from apache_beam.metrics import Metrics
+from apache_beam.utils.timestamp import Timestamp
 import logging
 import yaml
 import argparse
-from datetime import datetime
+from datetime import date, datetime, timezone
 import re
-import ast
+import sys
+import functools
+try:
+    import ciso8601
+except ImportError:
+    ciso8601 = None
+
+# ISO 8601 TIMESTAMPs checked with ciso8601 or fromisoformat. Both parsers only see matching values, so the
+# accepted set doesn't depend on ciso8601 being installed (it alone takes dates, compact forms and hour 24).
+_ISO_TS_RE = re.compile(r"^\d{4}-\d{2}-\d{2}T(?:[01]\d|2[0-3]):\d{2}:\d{2}(?:\.\d+)?(?:Z|[+-]\d{2}:[0-5]\d)?$")
+_BOOL_STRS = frozenset(('true', 'false', '1', '0'))
+
+if sys.version_info >= (3, 11):
+    _fromisoformat = datetime.fromisoformat
+else:
+    def _fromisoformat(value):
+        # Before Python 3.11 datetime.fromisoformat does not accept a trailing 'Z'.
+        return datetime.fromisoformat(value[:-1] + '+00:00' if value.endswith('Z') else value)
 
 
 data = [
@@ -22,108 +41,378 @@ data3 = {'data':[
 ]}
 
 
-class FormatToBqRow(beam.DoFn):
-    def __init__(self,column_names):
-        self.column_names = column_names
-
-    def process(self,element):
-        data = element['parsed_data']
-        print('converting to bq format')
-        dict_data = []
-        for row in data:
-            dict_row = {col_name: value for col_name, value in zip(self.column_names, row)}
-            dict_data.append(dict_row)
-            yield dict_row
-
 class SchemaValidationException(Exception):
     pass
+
+_STRING_TYPES = ('STRING', 'BYTES', 'JSON', 'GEOGRAPHY', 'INTERVAL')
+_INT_TYPES = ('INT64', 'INTEGER', 'INT', 'SMALLINT', 'BIGINT', 'TINYINT', 'BYTEINT')
+_FLOAT_TYPES = ('NUMERIC', 'DECIMAL', 'BIGNUMERIC', 'BIGDECIMAL', 'FLOAT64')
+
+def _parse_iso_date(value):
+    # Fixed 'YYYY-MM-DD' form, much cheaper than datetime.strptime.
+    # int() alone would also take signs, spaces and non-ASCII digits in each part.
+    digits = value[:4] + value[5:7] + value[8:10]
+    if len(value) != 10 or value[4] != '-' or value[7] != '-' or not (digits.isascii() and digits.isdigit()):
+        raise ValueError(f"Invalid date: {value!r}")
+    return date(int(value[:4]), int(value[5:7]), int(value[8:10]))
+
+def _parse_bool(value):
+    if isinstance(value, bool):
+        return value
+    lowered = str(value).lower()
+    if lowered in ('true', '1'):
+        return True
+    if lowered in ('false', '0'):
+        return False
+    raise ValueError(value)
+
+# Parser for each field type, types without an entry are passed through unchanged.
+_PARSE_BY_TYPE = {
+    **dict.fromkeys(_STRING_TYPES, str),
+    **dict.fromkeys(_INT_TYPES, int),
+    **dict.fromkeys(_FLOAT_TYPES, float),
+    'BOOL': _parse_bool,
+}
+
+# Type validators used by validate_type, each returns True if the value can be converted to its type.
+_TIMESTAMP_FORMATS = ('%Y-%m-%d %H:%M:%S.%f %Z', '%Y-%m-%d %H:%M:%S %Z', '%Y-%m-%d %H:%M:%S.%f', '%Y-%m-%d %H:%M:%S')
+
+def _v_str(value):
+    try:
+        str(value)
+    except (ValueError, TypeError):
+        return False
+    return True
+
+def _v_int(value):
+    try:
+        int(value)
+    except (ValueError, TypeError):
+        return False
+    return True
+
+def _v_float(value):
+    try:
+        float(value)
+    except (ValueError, TypeError):
+        return False
+    return True
+
+def _v_bool(value):
+    if isinstance(value, bool):
+        return True
+    lowered = value.lower() if isinstance(value, str) else str(value).lower()
+    return lowered in _BOOL_STRS
+
+@functools.lru_cache(maxsize=4096)
+def _is_valid_iso_date(value):
+    try:
+        _parse_iso_date(value)
+    except ValueError:
+        return False
+    return True
+
+def _v_date(value):
+    # Only strings are cached, date columns usually repeat a handful of values.
+    return isinstance(value, str) and _is_valid_iso_date(value)
+
+def _v_datetime(value):
+    try:
+        datetime.strptime(value, '%Y-%m-%d %H:%M:%S')
+    except (ValueError, TypeError):
+        return False
+    return True
+
+def _v_time(value):
+    try:
+        datetime.strptime(value, '%H:%M:%S')
+    except (ValueError, TypeError):
+        return False
+    return True
+
+def _parse_timestamp(value):
+    # Shared by TIMESTAMP validation and the Storage Write API conversion, so both accept the same values.
+    if _ISO_TS_RE.match(value):
+        return ciso8601.parse_datetime(value) if ciso8601 is not None else _fromisoformat(value)
+    # Not ISO 8601, fall back to the '%Z' and space separated formats.
+    for fmt in _TIMESTAMP_FORMATS:
+        try:
+            return datetime.strptime(value, fmt)
+        except ValueError:
+            pass
+    raise ValueError(f"Invalid timestamp: {value!r}")
+
+@functools.lru_cache(maxsize=4096)
+def _is_valid_timestamp(value):
+    try:
+        _parse_timestamp(value)
+    except ValueError:
+        return False
+    return True
+
+def _v_timestamp(value):
+    # Only strings are cached, both the ISO and the strptime results are memoised.
+    return isinstance(value, str) and _is_valid_timestamp(value)
+
+_VALIDATORS = {
+    **dict.fromkeys(_STRING_TYPES, _v_str),
+    **dict.fromkeys(_INT_TYPES, _v_int),
+    **dict.fromkeys(_FLOAT_TYPES, _v_float),
+    'BOOL': _v_bool,
+    'DATE': _v_date,
+    'DATETIME': _v_datetime,
+    'TIME': _v_time,
+    'TIMESTAMP': _v_timestamp,
+}
+
+def _freeze_schema(schema):
+    # (name, type, mode) of each field, so hot paths don't repeat the dict lookups.
+    return tuple((field['name'], field['type'], field.get('mode', 'NULLABLE')) for field in schema)
+
+def compile_validator(schema, fast=False):
+    """
+    Generate a row validator specialised for a BigQuery schema.
+
+    The per-field validation loop is unrolled into straight-line Python
+    source, so field names, types and modes are resolved once here instead of
+    once per row. Type checks call the _VALIDATORS predicates, which never raise.
+
+    Parameters:
+    schema (list): The BigQuery table schema as a list of dictionaries.
+    fast (bool): Return False for an invalid row instead of raising, without building an error message.
+
+    Returns:
+    function: Takes a single row and returns True if it matches the schema. Otherwise raises
+    SchemaValidationException, or returns False in fast mode.
+    """
+    def fail(message):
+        return 'return False' if fast else 'raise SchemaValidationException(%s)' % message
+
+    namespace = {
+        'SchemaValidationException': SchemaValidationException,
+        '_BOOL_STRS': _BOOL_STRS,
+    }
+    lines = [
+        'def _v(row):',
+        '    if len(row) != %d:' % len(schema),
+        '        ' + fail(repr("Row length does not match schema length.")),
+    ]
+    for i, (field_name, field_type, field_mode) in enumerate(_freeze_schema(schema)):
+        # The message is only formatted once a value has failed its check.
+        type_error = fail('%r %% (v,)' % (
+            "Field '%s' with value '%%s' cannot be converted to type '%s'."
+            % (field_name.replace('%', '%%'), field_type.replace('%', '%%'))))
+        namespace['_check%d' % i] = _VALIDATORS.get(field_type, _v_str)
+
+        if field_type in _STRING_TYPES:
+            # str() accepts any value, there is nothing to check.
+            check = []
+        elif field_type in _INT_TYPES:
+            check = ['if not isinstance(v, int) and not _check%d(v):' % i,
+                     '    ' + type_error]
+        elif field_type in _FLOAT_TYPES:
+            check = ['if not isinstance(v, float) and not _check%d(v):' % i,
+                     '    ' + type_error]
+        elif field_type == 'BOOL':
+            check = ['if not isinstance(v, bool) and str(v).lower() not in _BOOL_STRS:',
+                     '    ' + type_error]
+        else:
+            check = ['if not _check%d(v):' % i,
+                     '    ' + type_error]
+
+        if field_mode != 'REQUIRED' and not check:
+            continue
+        lines.append('    v = row[%d]' % i)
+        if field_mode == 'REQUIRED':
+            lines.append('    if v is None:')
+            lines.append('        ' + fail(repr(f"Field '{field_name}' is required but is missing.")))
+            indent = '    '
+        else:
+            lines.append('    if v is not None:')
+            indent = '        '
+
+        lines.extend(indent + line for line in check)
+    lines.append('    return True')
+
+    exec('\n'.join(lines), namespace)
+    return namespace['_v']
+
+# Compiled validators keyed by schema, shared by every DoFn instance in the worker process.
+_VALIDATOR_CACHE = {}
+
+def _get_validator(schema, fast=False):
+    key = (_freeze_schema(schema), fast)
+    validator = _VALIDATOR_CACHE.get(key)
+    if validator is None:
+        validator = _VALIDATOR_CACHE[key] = compile_validator(schema, fast)
+    return validator
+
 class SchemaValidation(beam.DoFn):
-        def __init__(self, schema):
+        def __init__(self, schema, fast=False):
             self.schema = schema
+            self.fast = fast
+            self._names = tuple(field['name'] for field in schema)
+            self._types = tuple(field['type'] for field in schema)
+            self._row_validator = _get_validator(schema, fast)
+            self._parsers = [_PARSE_BY_TYPE.get(field_type) for field_type in self._types]
+            self.rows_ok = Metrics.counter('validation', 'rows_ok')
+            self.rows_invalid = Metrics.counter('validation', 'rows_invalid')
+
+        def __getstate__(self):
+            # Generated functions are not picklable, fetch them from the cache on the worker instead.
+            state = self.__dict__.copy()
+            del state['_row_validator']
+            return state
+
+        def __setstate__(self, state):
+            self.__dict__.update(state)
+            self._row_validator = _get_validator(self.schema, self.fast)
 
         def process(self, element):
-            data = element['data']
+            # Each element is a single row, so the runner can spread rows across workers.
+            parsed_row = self.parse_row(element, self._parsers)
             try:
-                parsed_data = self.parse_data(data)
-                self.validate_data(parsed_data, self.schema)
-                print("Data is valid according to the schema.")
-                element['parsed_data'] = parsed_data
-                yield element
+                valid = self._row_validator(parsed_row)
             except SchemaValidationException as e:
-                print(f"Schema validation error: {e}")
-
-        def validate_data(self, data, schema):
-
-            for row in data:
-                #print("length of row and schema",len(row),len(schema))
-                if len(row) != len(schema):
-                    raise SchemaValidationException("Row length does not match schema length.")
-                
-                for value, field in zip(row, schema):
-                    field_name = field['name']
-                    field_type = field['type']
-                    field_mode = field.get('mode', 'NULLABLE')
-                    
-                    if field_mode == 'REQUIRED' and value is None:
-                        raise SchemaValidationException(f"Field '{field_name}' is required but is missing.")
-                    
-                    if value is not None:
-                        if not self.validate_type(value, field_type):
-                            raise SchemaValidationException(f"Field '{field_name}' with value '{value}' cannot be converted to type '{field_type}'.")
-
-        def validate_type(self, value, field_type):
+                logging.warning(f"Schema validation error: {e}")
+                valid = False
+            if not valid:
+                self.rows_invalid.inc()
+                return
+            self.rows_ok.inc()
+            yield parsed_row
 
-            try:
-                if field_type in ['STRING', 'BYTES', 'JSON', 'GEOGRAPHY', 'INTERVAL']:
-                    str(value)
-                elif field_type in ['INT64', 'INTEGER', 'INT', 'SMALLINT', 'BIGINT', 'TINYINT', 'BYTEINT']:
-                    int(value)
-                elif field_type in ['NUMERIC', 'DECIMAL', 'BIGNUMERIC', 'BIGDECIMAL', 'FLOAT64']:
-                    float(value)
-                elif field_type == 'BOOL':
-                    if str(value).lower() not in ['true', 'false', '1', '0']:
-                        return False
-                elif field_type == 'DATE':
-                    datetime.strptime(value, '%Y-%m-%d')
-                elif field_type == 'DATETIME':
-                    datetime.strptime(value, '%Y-%m-%d %H:%M:%S')
-                elif field_type == 'TIME':
-                    datetime.strptime(value, '%H:%M:%S')
-                elif field_type == 'TIMESTAMP':
-                    try:
-                        if re.match(r"^\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2}(?:\.\d+)?(?:Z|[+-]\d{2}:\d{2})?$", value):
-                            datetime.fromisoformat(value.replace('Z', '+00:00'))
-                        else:
-                            datetime.strptime(value, '%Y-%m-%d %H:%M:%S.%f %Z')
-                    except ValueError:
-                        try:
-                            datetime.strptime(value, '%Y-%m-%d %H:%M:%S %Z')
-                        except ValueError:
-                            try:
-                                datetime.strptime(value, '%Y-%m-%d %H:%M:%S.%f')
-                            except ValueError:
-                                datetime.strptime(value, '%Y-%m-%d %H:%M:%S')
+        @staticmethod
+        def validate_type(value, field_type):
+            # Types without a validator only need to be convertible to a string.
+            return _VALIDATORS.get(field_type, _v_str)(value)
+
+        @staticmethod
+        def parse_row(row, parsers):
+            if len(row) != len(parsers):
+                return list(row)  # Left for the row validator to reject
+            parsed_row = []
+            for parser, item in zip(parsers, row):
+                if item is None or item == 'None':
+                    parsed_item = None
+                elif parser is None:
+                    parsed_item = item
                 else:
-                    str(value)
-                return True
-            except (ValueError, TypeError):
-                return False
-            
-        def parse_data(self,data):
-            parsed_data = []
-            for row in data:
-                parsed_row = []
-                for item in row:
                     try:
-                        parsed_item = ast.literal_eval(item)
-                    except (ValueError, SyntaxError):
-                        parsed_item = item  # If literal_eval fails, keep it as a string
-                    parsed_row.append(parsed_item)
-                parsed_data.append(parsed_row)
-            return parsed_data
+                        parsed_item = parser(item)
+                    except (ValueError, TypeError):
+                        parsed_item = item  # If parsing fails, keep the raw value for validation to report
+                parsed_row.append(parsed_item)
+            return parsed_row
+
+class ValidateAndFormat(SchemaValidation):
+    """
+    Parse, validate and convert rows to BigQuery format in a single pass.
+
+    Rows failing validation are reported and skipped, or only counted in fast
+    mode. The remaining rows are yielded as dictionaries keyed by column name.
+    """
+    def __init__(self, schema, fast=False):
+        super().__init__(schema, fast)
+        self.column_names = list(self._names)
+
+    def process(self, element):
+        column_names = self.column_names
+        for parsed_row in super().process(element):
+            yield dict(zip(column_names, parsed_row))
+
+# Field types STORAGE_WRITE_API can write from the rows ValidateAndFormat yields.
+_STORAGE_WRITE_TYPES = frozenset(('STRING', 'GEOGRAPHY', 'INT64', 'INTEGER', 'FLOAT64', 'FLOAT',
+                                  'BOOL', 'BOOLEAN', 'TIMESTAMP'))
+
+def check_storage_write_schema(schema):
+    """
+    Check that STORAGE_WRITE_API can write every field of a schema.
+
+    Beam converts rows for this method through its own type mapping, which has
+    no DATE, DATETIME or TIME support, so fail here with a readable message
+    instead of from inside Beam.
+
+    Parameters:
+    schema (list): The BigQuery table schema as a list of dictionaries.
+
+    Raises:
+    ValueError: If a field type cannot be written with STORAGE_WRITE_API.
+    """
+    unsupported = [f"{field['name']} ({field['type']})" for field in schema if field['type'] not in _STORAGE_WRITE_TYPES]
+    if unsupported:
+        raise ValueError(
+            "STORAGE_WRITE_API cannot write the fields %s, use --write_method FILE_LOADS or STREAMING_INSERTS."
+            % ', '.join(unsupported))
+
+def _to_beam_timestamp(value):
+    # Values have already been validated as TIMESTAMP, values without an offset are taken as UTC.
+    parsed = _parse_timestamp(value)
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return Timestamp.from_utc_datetime(parsed.astimezone(timezone.utc))
+
+def convert_timestamps(row, field_names):
+    """
+    Replace TIMESTAMP strings with Beam Timestamps, as STORAGE_WRITE_API expects.
+
+    Parameters:
+    row (dict): BigQuery row as yielded by ValidateAndFormat.
+    field_names (list): Names of the TIMESTAMP fields.
+
+    Returns:
+    dict: The row with its TIMESTAMP values converted.
+    """
+    row = dict(row)
+    for field_name in field_names:
+        if row[field_name] is not None:
+            row[field_name] = _to_beam_timestamp(row[field_name])
+    return row
+
+def bigquery_write_options(method, streaming):
+    """
+    Build the WriteToBigQuery arguments for a write method.
+
+    Each method is configured to send few large requests rather than many small ones.
+
+    Parameters:
+    method (str): One of the WriteToBigQuery.Method values.
+    streaming (bool): Whether the pipeline runs in streaming mode.
+
+    Returns:
+    dict: Keyword arguments for WriteToBigQuery.
+    """
+    options = {'method': method}
+    if method == WriteToBigQuery.Method.STORAGE_WRITE_API:
+        options['use_at_least_once'] = True
+    elif method == WriteToBigQuery.Method.STREAMING_INSERTS:
+        # Up to 10000 rows per insertAll request, without insert id deduplication.
+        options['batch_size'] = 10000
+        options['ignore_insert_ids'] = True
+    else:
+        # Batch loads go through GCS temp files, in files of up to 4 GiB.
+        options['max_file_size'] = 4 * 1024 ** 3
+        options['max_files_per_bundle'] = 20
+    if streaming:
+        # Beam only accepts these for unbounded input.
+        options['with_auto_sharding'] = True
+        if method != WriteToBigQuery.Method.STREAMING_INSERTS:
+            # Commit appended rows, or start load jobs, every 60 seconds.
+            options['triggering_frequency'] = 60
+    return options
+
 def run_pipeline(table,argv=None):
     # Create an argument parser
     parser = argparse.ArgumentParser()
+    parser.add_argument(
+        '--write_method',
+        choices=[WriteToBigQuery.Method.STORAGE_WRITE_API, WriteToBigQuery.Method.FILE_LOADS,
+                 WriteToBigQuery.Method.STREAMING_INSERTS],
+        help='BigQuery write method, defaults to STREAMING_INSERTS when streaming and FILE_LOADS otherwise.')
+    parser.add_argument(
+        '--fast_validation',
+        action='store_true',
+        help='Only count rows failing validation, without building error messages.')
     
     # Parse the command-line arguments
     known_args, pipeline_args = parser.parse_known_args(argv)
@@ -141,21 +430,31 @@ def run_pipeline(table,argv=None):
     {"name": "join_date", "type": "DATE", "mode": "REQUIRED"},
 ]
     
+    streaming = pipeline_options.view_as(StandardOptions).streaming
+    write_method = known_args.write_method or (
+        WriteToBigQuery.Method.STREAMING_INSERTS if streaming else WriteToBigQuery.Method.FILE_LOADS)
+    if write_method == WriteToBigQuery.Method.STORAGE_WRITE_API:
+        check_storage_write_schema(schema)
+
     # Create the pipeline
     with beam.Pipeline(options=pipeline_options) as p:
-        column_names=[col['name'] for col in schema]
-        (
+        rows = (
         p
-        | 'Read data' >> beam.Create([data3])
-        | 'Validate data with schema' >> beam.ParDo(SchemaValidation(schema))
-        | 'Convert to bq format' >> beam.ParDo(FormatToBqRow(column_names))
-        | 'Filter out null values' >> beam.Filter(lambda row: row is not None)
+        | 'Read data' >> beam.Create(data3['data'])
+        | 'Validate and convert to bq format' >> beam.ParDo(ValidateAndFormat(schema, fast=known_args.fast_validation))
         # | beam.Map(print)
+        )
+        if write_method == WriteToBigQuery.Method.STORAGE_WRITE_API:
+            timestamp_fields = [field['name'] for field in schema if field['type'] == 'TIMESTAMP']
+            rows = rows | 'Convert timestamps' >> beam.Map(convert_timestamps, timestamp_fields)
+        (
+        rows
         | 'Write to BigQuery' >> WriteToBigQuery(
             table=table,
             schema = {'fields':schema},
             write_disposition=beam.io.BigQueryDisposition.WRITE_APPEND,
-            create_disposition=beam.io.BigQueryDisposition.CREATE_IF_NEEDED
+            create_disposition=beam.io.BigQueryDisposition.CREATE_IF_NEEDED,
+            **bigquery_write_options(write_method, streaming)
         )
     )
 
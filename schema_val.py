@@ -1,16 +1,88 @@
-from datetime import datetime
+from datetime import date, datetime
 import re
+import sys
+import functools
 import ast
+try:
+    import ciso8601
+except ImportError:
+    ciso8601 = None
+
+# Gates both ISO parsers, so TIMESTAMP validation doesn't depend on ciso8601 being installed.
+_ISO_TS_RE = re.compile(r"^\d{4}-\d{2}-\d{2}T(?:[01]\d|2[0-3]):\d{2}:\d{2}(?:\.\d+)?(?:Z|[+-]\d{2}:[0-5]\d)?$")
+_BOOL_STRS = frozenset(('true', 'false', '1', '0'))
+
+if sys.version_info >= (3, 11):
+    _fromisoformat = datetime.fromisoformat
+else:
+    def _fromisoformat(value):
+        # Before Python 3.11 datetime.fromisoformat does not accept a trailing 'Z'.
+        return datetime.fromisoformat(value[:-1] + '+00:00' if value.endswith('Z') else value)
+
+_STRING_TYPES = ('STRING', 'BYTES', 'JSON', 'GEOGRAPHY', 'INTERVAL')
+_INT_TYPES = ('INT64', 'INTEGER', 'INT', 'SMALLINT', 'BIGINT', 'TINYINT', 'BYTEINT')
+_FLOAT_TYPES = ('NUMERIC', 'DECIMAL', 'BIGNUMERIC', 'BIGDECIMAL', 'FLOAT64')
+
+def _parse_iso_date(value):
+    # Fixed 'YYYY-MM-DD' form, much cheaper than datetime.strptime.
+    # int() alone would also take signs, spaces and non-ASCII digits in each part.
+    digits = value[:4] + value[5:7] + value[8:10]
+    if len(value) != 10 or value[4] != '-' or value[7] != '-' or not (digits.isascii() and digits.isdigit()):
+        raise ValueError(f"Invalid date: {value!r}")
+    return date(int(value[:4]), int(value[5:7]), int(value[8:10]))
+
+def _parse_bool(value):
+    if isinstance(value, bool):
+        return value
+    lowered = str(value).lower()
+    if lowered in ('true', '1'):
+        return True
+    if lowered in ('false', '0'):
+        return False
+    raise ValueError(value)
+
+def _parse_literal(value):
+    return ast.literal_eval(value) if isinstance(value, str) else value
+
+# Parser for each field type, types without an entry are passed through unchanged.
+_PARSE_BY_TYPE = {
+    **dict.fromkeys(_STRING_TYPES, str),
+    **dict.fromkeys(_INT_TYPES, int),
+    **dict.fromkeys(_FLOAT_TYPES, float),
+    'BOOL': _parse_bool,
+    'ARRAY': _parse_literal,
+    'STRUCT': _parse_literal,
+    'RANGE': _parse_literal,
+}
+
+def parse_data(data, schema):
+    """
+    Convert raw row values to the Python types of their schema fields.
+
+    Parameters:
+    data (list): The nested list data to parse.
+    schema (list): The BigQuery table schema as a list of dictionaries.
 
-def parse_data(data):
+    Returns:
+    list: Nested list of parsed values. Values that cannot be parsed are kept as is.
+    """
+    parsers = [_PARSE_BY_TYPE.get(field['type']) for field in schema]
     parsed_data = []
     for row in data:
+        if len(row) != len(parsers):
+            parsed_data.append(list(row))  # Left for validate_data to reject
+            continue
         parsed_row = []
-        for item in row:
-            try:
-                parsed_item = ast.literal_eval(item)
-            except (ValueError, SyntaxError):
-                parsed_item = item  # If literal_eval fails, keep it as a string
+        for parser, item in zip(parsers, row):
+            if item is None or item == 'None':
+                parsed_item = None
+            elif parser is None:
+                parsed_item = item
+            else:
+                try:
+                    parsed_item = parser(item)
+                except (ValueError, TypeError, SyntaxError):
+                    parsed_item = item  # If parsing fails, keep the raw value for validation to report
             parsed_row.append(parsed_item)
         parsed_data.append(parsed_row)
     return parsed_data
@@ -47,21 +119,114 @@ def validate_data(data, schema):
     Raises:
     SchemaValidationException: If the data does not match the schema.
     """
+    # Resolve the field attributes once instead of once per row.
+    names = tuple(field['name'] for field in schema)
+    types = tuple(field['type'] for field in schema)
+    modes = tuple(field.get('mode', 'NULLABLE') for field in schema)
+    n_fields = len(schema)
     for row in data:
-        if len(row) != len(schema):
+        if len(row) != n_fields:
             raise SchemaValidationException("Row length does not match schema length.")
         
-        for value, field in zip(row, schema):
-            field_name = field['name']
-            field_type = field['type']
-            field_mode = field.get('mode', 'NULLABLE')
-            
-            if field_mode == 'REQUIRED' and value is None:
-                raise SchemaValidationException(f"Field '{field_name}' is required but is missing.")
-            
-            if value is not None:
-                if not validate_type(value, field_type):
-                    raise SchemaValidationException(f"Field '{field_name}' with value '{value}' cannot be converted to type '{field_type}'.")
+        for i in range(n_fields):
+            value = row[i]
+            if value is None:
+                if modes[i] == 'REQUIRED':
+                    raise SchemaValidationException(f"Field '{names[i]}' is required but is missing.")
+            elif not validate_type(value, types[i]):
+                raise SchemaValidationException(f"Field '{names[i]}' with value '{value}' cannot be converted to type '{types[i]}'.")
+
+# Type validators used by validate_type, each returns True if the value can be converted to its type.
+_TIMESTAMP_FORMATS = ('%Y-%m-%d %H:%M:%S.%f %Z', '%Y-%m-%d %H:%M:%S %Z', '%Y-%m-%d %H:%M:%S.%f', '%Y-%m-%d %H:%M:%S')
+
+def _v_str(value):
+    try:
+        str(value)
+    except (ValueError, TypeError):
+        return False
+    return True
+
+def _v_int(value):
+    try:
+        int(value)
+    except (ValueError, TypeError):
+        return False
+    return True
+
+def _v_float(value):
+    try:
+        float(value)
+    except (ValueError, TypeError):
+        return False
+    return True
+
+def _v_bool(value):
+    if isinstance(value, bool):
+        return True
+    lowered = value.lower() if isinstance(value, str) else str(value).lower()
+    return lowered in _BOOL_STRS
+
+@functools.lru_cache(maxsize=4096)
+def _is_valid_iso_date(value):
+    try:
+        _parse_iso_date(value)
+    except ValueError:
+        return False
+    return True
+
+def _v_date(value):
+    # Only strings are cached, date columns usually repeat a handful of values.
+    return isinstance(value, str) and _is_valid_iso_date(value)
+
+def _v_datetime(value):
+    try:
+        datetime.strptime(value, '%Y-%m-%d %H:%M:%S')
+    except (ValueError, TypeError):
+        return False
+    return True
+
+def _v_time(value):
+    try:
+        datetime.strptime(value, '%H:%M:%S')
+    except (ValueError, TypeError):
+        return False
+    return True
+
+@functools.lru_cache(maxsize=4096)
+def _is_valid_timestamp(value):
+    if _ISO_TS_RE.match(value):
+        try:
+            if ciso8601 is not None:
+                ciso8601.parse_datetime(value)
+            else:
+                _fromisoformat(value)
+        except ValueError:
+            return False
+        return True
+    # Not ISO 8601, fall back to the '%Z' and space separated formats.
+    for fmt in _TIMESTAMP_FORMATS:
+        try:
+            datetime.strptime(value, fmt)
+            return True
+        except ValueError:
+            pass
+    return False
+
+def _v_timestamp(value):
+    # Only strings are cached, both the ISO and the strptime results are memoised.
+    return isinstance(value, str) and _is_valid_timestamp(value)
+
+_VALIDATORS = {
+    **dict.fromkeys(_STRING_TYPES, _v_str),
+    **dict.fromkeys(_INT_TYPES, _v_int),
+    **dict.fromkeys(_FLOAT_TYPES, _v_float),
+    'BOOL': _v_bool,
+    'DATE': _v_date,
+    'DATETIME': _v_datetime,
+    'TIME': _v_time,
+    'TIMESTAMP': _v_timestamp,
+    # ARRAY, STRUCT and RANGE are not validated yet, see the commented out checks in validate_type.
+}
 
 def validate_type(value, field_type):
     """
@@ -74,37 +239,9 @@ def validate_type(value, field_type):
     Returns:
     bool: True if the value can be converted to the field type, False otherwise.
     """
-    try:
-        if field_type in ['STRING', 'BYTES', 'JSON', 'GEOGRAPHY', 'INTERVAL']:
-            str(value)
-        elif field_type in ['INT64', 'INTEGER', 'INT', 'SMALLINT', 'BIGINT', 'TINYINT', 'BYTEINT']:
-            int(value)
-        elif field_type in ['NUMERIC', 'DECIMAL', 'BIGNUMERIC', 'BIGDECIMAL', 'FLOAT64']:
-            float(value)
-        elif field_type == 'BOOL':
-            if str(value).lower() not in ['true', 'false', '1', '0']:
-                return False
-        elif field_type == 'DATE':
-            datetime.strptime(value, '%Y-%m-%d')
-        elif field_type == 'DATETIME':
-            datetime.strptime(value, '%Y-%m-%d %H:%M:%S')
-        elif field_type == 'TIME':
-            datetime.strptime(value, '%H:%M:%S')
-        elif field_type == 'TIMESTAMP':
-            try:
-                if re.match(r"^\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2}(?:\.\d+)?(?:Z|[+-]\d{2}:\d{2})?$", value):
-                    datetime.fromisoformat(value.replace('Z', '+00:00'))
-                else:
-                    datetime.strptime(value, '%Y-%m-%d %H:%M:%S.%f %Z')
-            except ValueError:
-                try:
-                    datetime.strptime(value, '%Y-%m-%d %H:%M:%S %Z')
-                except ValueError:
-                    try:
-                        datetime.strptime(value, '%Y-%m-%d %H:%M:%S.%f')
-                    except ValueError:
-                        datetime.strptime(value, '%Y-%m-%d %H:%M:%S')
-        # elif field_type == 'ARRAY':
+    validator = _VALIDATORS.get(field_type)
+    if validator is None:
+        # if field_type == 'ARRAY':
         #     if not isinstance(value, list):
         #         return False
         #     for item in value:
@@ -119,11 +256,8 @@ def validate_type(value, field_type):
         #     for item in value:
         #         if not validate_type(item, 'DATE'):
         #             return False
-        else:
-            return False
-        return True
-    except (ValueError, TypeError):
         return False
+    return validator(value)
 
 # Example usage
 data = [
@@ -158,7 +292,7 @@ schema = [
     {"name": "metadata", "type": "STRUCT", "mode": "NULLABLE"},
     {"name": "validity_period", "type": "RANGE", "mode": "NULLABLE"}
 ]
-parsed_data1 = parse_data(data4)
+parsed_data1 = parse_data(data4, schema)
 print(parsed_data1)
 try:
     validate_data(parsed_data1, schema)